@@ -0,0 +1,22 @@
+from typing import Any
+
+import orjson
+from fastapi.responses import ORJSONResponse
+
+
+class UTCORJSONResponse(ORJSONResponse):
+    """
+    ORJSONResponse that writes UTC datetimes with a `Z` suffix,
+    as Pydantic does, instead of orjson's default `+00:00`.
+
+    Use this for responses serialized directly rather than through a
+    response model, so every datetime in the API has the same format.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content,
+            option=orjson.OPT_NON_STR_KEYS
+            | orjson.OPT_SERIALIZE_NUMPY
+            | orjson.OPT_UTC_Z,
+        )
@@ -4,13 +4,14 @@ from typing import Any
 from fastapi import APIRouter, Depends, HTTPException, Response
 from pydantic import BaseModel, EmailStr, Field
 from webauthn.helpers import (
-    options_to_json_dict,
     parse_authentication_credential_json,
     parse_registration_credential_json,
 )
 
+from src.api.responses import UTCORJSONResponse
 from src.dependencies import identity_service, session, SESSION_COOKIE_NAME
 from src.services.identity.identity_service import (
+    Account,
     IdentityService,
     InvalidAccountError,
     InvalidCredentialError,
@@ -29,6 +30,9 @@ class CreateAccountRequest(BaseModel):
     display_name: str = Field(min_length=1)
 
 
+# Response models are built from data returned by the IdentityService,
+# which is already trusted, so the handlers use `model_construct()`
+# to skip re-validating every field.
 class AccountResponse(BaseModel):
     id: str
     email: str
@@ -77,6 +81,19 @@ class CreateSessionResponse(BaseModel):
 router = APIRouter()
 
 
+def _account_payload(account: Account) -> dict[str, Any]:
+    """
+    Returns the fields of an `AccountResponse` for the account, ready for
+    `AccountResponse.model_construct()` or for returning directly.
+    """
+    return {
+        "id": account.id,
+        "email": account.email,
+        "display_name": account.display_name,
+        "created_at": account.created_at,
+    }
+
+
 @router.post(
     "/accounts",
     status_code=201,
@@ -92,18 +109,12 @@ async def create_account(
     new_account = NewAccount(email=request.email, display_name=request.display_name)
     try:
         outcome = await identity_service.create_account(new_account)
-        account = outcome.account
-        return CreateAccountResponse(
-            account=AccountResponse(
-                id=account.id,
-                email=account.email,
-                display_name=account.display_name,
-                created_at=account.created_at,
+        return CreateAccountResponse.model_construct(
+            account=AccountResponse.model_construct(
+                **_account_payload(outcome.account)
             ),
             challenge_id=outcome.challenge_id,
-            passkey_creation_options=options_to_json_dict(
-                outcome.passkey_creation_options
-            ),
+            passkey_creation_options=outcome.passkey_creation_options_json,
         )
     except EmailAlreadyExistsError:
         raise HTTPException(
@@ -114,6 +125,8 @@ async def create_account(
 @router.post(
     "/accounts/{account_id}/challenges",
     status_code=201,
+    response_model=None,
+    responses={201: {"model": CreateRegistrationChallengeResponse}},
     description=(
         "Returns registration options for a new passkey on an existing account."
         " POST to /accounts/{account_id}/credentials to complete registration."
@@ -122,16 +135,19 @@ async def create_account(
 async def create_registration_challenge(
     account_id: str,
     identity_service: IdentityService = Depends(identity_service),
-) -> CreateRegistrationChallengeResponse:
+) -> UTCORJSONResponse:
     challenge = await identity_service.create_registration_challenge(
         AccountID(account_id)
     )
-    return CreateRegistrationChallengeResponse(
-        account_id=challenge.account_id,
-        challenge_id=challenge.challenge_id,
-        passkey_creation_options=options_to_json_dict(
-            challenge.passkey_creation_options
-        ),
+    # The passkey options are the bulk of this response and are already
+    # JSON-ready, so skip response model validation and serialize directly.
+    return UTCORJSONResponse(
+        status_code=201,
+        content={
+            "account_id": challenge.account_id,
+            "challenge_id": challenge.challenge_id,
+            "passkey_creation_options": challenge.passkey_creation_options_json,
+        },
     )
 
 
@@ -163,12 +179,14 @@ async def add_credential(
 @router.post(
     "/sessions/challenges",
     status_code=201,
+    response_model=None,
+    responses={201: {"model": CreateAuthenticationChallengeResponse}},
     description="Returns passkey authentication options for starting a new session.",
 )
 async def create_authentication_challenge(
     request: CreateAuthenticationChallengeRequest,
     identity_service: IdentityService = Depends(identity_service),
-) -> CreateAuthenticationChallengeResponse:
+) -> UTCORJSONResponse:
     try:
         outcome = await identity_service.create_authentication_challenge(
             email=request.email
@@ -176,12 +194,15 @@ async def create_authentication_challenge(
     except InvalidAccountError:
         raise HTTPException(404, f"No account with email '{request.email}'.")
 
-    return CreateAuthenticationChallengeResponse(
-        account_id=outcome.account_id,
-        challenge_id=outcome.challenge_id,
-        passkey_authentication_options=options_to_json_dict(
-            outcome.passkey_authentication_options
-        ),
+    return UTCORJSONResponse(
+        status_code=201,
+        content={
+            "account_id": outcome.account_id,
+            "challenge_id": outcome.challenge_id,
+            "passkey_authentication_options": (
+                outcome.passkey_authentication_options_json
+            ),
+        },
     )
 
 
@@ -204,24 +225,19 @@ async def create_session(
         secure=True,  # Setting this requires you to run https even on localhost!
         max_age=(session.expires_at - datetime.now(timezone.utc)).seconds,
     )
-    account = session.account
-    return CreateSessionResponse(
-        account=AccountResponse(
-            id=account.id,
-            email=account.email,
-            display_name=account.display_name,
-            created_at=account.created_at,
-        ),
+    return CreateSessionResponse.model_construct(
+        account=AccountResponse.model_construct(**_account_payload(session.account)),
         session_expires_at=session.expires_at,
     )
 
 
-@router.get("/accounts/me", description="Returns the currently signed-in account.")
-async def get_accounts_me(session: Session = Depends(session)) -> AccountResponse:
-    account = session.account
-    return AccountResponse(
-        id=account.id,
-        email=account.email,
-        display_name=account.display_name,
-        created_at=account.created_at,
-    )
+@router.get(
+    "/accounts/me",
+    response_model=None,
+    responses={200: {"model": AccountResponse}},
+    description="Returns the currently signed-in account.",
+)
+async def get_accounts_me(session: Session = Depends(session)) -> UTCORJSONResponse:
+    # This is requested on every page load, so skip response model
+    # validation and serialize the account fields directly.
+    return UTCORJSONResponse(_account_payload(session.account))
@@ -1,6 +1,6 @@
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Request, Depends, HTTPException
+from fastapi import FastAPI, Request, HTTPException
 from psycopg_pool import AsyncConnectionPool
 from pydantic import PostgresDsn
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -23,13 +23,23 @@ SESSION_COOKIE_NAME = "session_token"
 class ServerSettings(BaseSettings):
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
     postgres_dsn: PostgresDsn
+    postgres_pool_min_size: int = 4
+    postgres_pool_max_size: int = 20
     session_signing_keys: list[bytes]
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     server_settings = ServerSettings()
-    async with AsyncConnectionPool(str(server_settings.postgres_dsn)) as pool:
+    async with AsyncConnectionPool(
+        str(server_settings.postgres_dsn),
+        min_size=server_settings.postgres_pool_min_size,
+        max_size=server_settings.postgres_pool_max_size,
+        open=False,
+    ) as pool:
+        # Open all min_size connections before serving, so the first
+        # requests don't have to wait for connections to be established.
+        await pool.wait()
         store = await PostgresIdentityStore.create(pool)
         app.state.identity_service = IdentityService(
             store=store,
@@ -41,20 +51,20 @@ async def lifespan(app: FastAPI):
         yield
 
 
-def identity_service(request: Request) -> IdentityService:
+async def identity_service(request: Request) -> IdentityService:
     return request.app.state.identity_service
 
 
-async def session(
-    request: Request, identity_service: IdentityService = Depends(identity_service)
-) -> Session:
+async def session(request: Request) -> Session:
+    # Read straight from app state rather than Depends(identity_service)
+    # to save a dependency node on every authenticated request.
+    identity_service: IdentityService = request.app.state.identity_service
     session_cookie = request.cookies.get(SESSION_COOKIE_NAME)
     if session_cookie is None:
         raise HTTPException(
             403,
             f"This API requires a valid session token cookie named {SESSION_COOKIE_NAME}",
         )
-
     try:
         return await identity_service.verify_session(Token(session_cookie))
     except (InvalidSignatureError, InvalidTokenError):
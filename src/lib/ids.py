@@ -1,5 +1,7 @@
 import secrets
 import string
+from datetime import datetime, timezone
+from itertools import product
 from typing import Final, Type
 
 import uuid_utils as uuid
@@ -11,15 +13,16 @@ class BaseID(str):
 
     To define a new ID type, create a class that inherits from
     `BaseID`, and set its `PREFIX` class variable to a string
-    value that is unique across all BaseID subclasses.
+    value that is unique across all BaseID subclasses, and that
+    does not contain the `PREFIX_SEPARATOR` (an underscore).
 
     Example:
         >>> class TestID(BaseID):
         ...     PREFIX = "test"
 
     If the PREFIX value is not unique across all subclasses
-    of BaseID, a ValueError will be raised when the class is
-    created.
+    of BaseID, or contains the separator, a ValueError will be
+    raised when the class is created.
 
     To generate a new ID, just create a new instance of your
     derived class with no arguments:
@@ -33,6 +36,10 @@ class BaseID(str):
     UUID is encoded in base36 instead of hex (base16) to keep
     it shorter.
 
+    If the class sets `ORDERED = False`, the value will instead
+    be 128 random bits encoded in base64url, which has no order
+    to preserve, is shorter still, and is encoded in C.
+
     The `id` will be typed as a `TestID`, but since it inherits
     from `BaseID` and that inherits from `str`, you can treat
     `id` as a string. Database libraries and other encoders
@@ -56,6 +63,12 @@ class BaseID(str):
     You can then test the `type(parsed_id)` to determine
     which type it is.
 
+    For ordered IDs, `created_at` returns the time the ID was
+    generated, read from the UUIDv7 timestamp.
+
+    Example:
+        >>> id.created_at
+
     author: Dave Stearns <https://github.com/davestearns>
     """
 
@@ -63,6 +76,13 @@ class BaseID(str):
     ALPHABET: Final = string.digits + string.ascii_lowercase
     ALPHABET_LEN: Final = len(ALPHABET)
 
+    # Base36 encoding is done a few digits at a time using a table of
+    # every possible chunk, which takes far fewer Python-level loop
+    # iterations than dividing out one digit at a time.
+    _CHUNK_LEN: Final = 2
+    _CHUNK_BASE: Final = ALPHABET_LEN**_CHUNK_LEN
+    _CHUNK_TABLE: Final = ["".join(p) for p in product(ALPHABET, repeat=_CHUNK_LEN)]
+
     PREFIX: str
     """
     Each derived class must set PREFIX to a unique string.
@@ -79,25 +99,35 @@ class BaseID(str):
 
     prefix_to_class_map: dict[str, Type["BaseID"]] = {}
 
+    _full_prefix: str
+    """
+    PREFIX followed by PREFIX_SEPARATOR, set when the subclass is created.
+    """
+
     def __new__(cls, encoded_id: str | None = None):
         if encoded_id is None:
-            # Generate a new UUID
-            id_int = uuid.uuid7().int if cls.ORDERED else secrets.randbits(128)
-
-            # Base36 encode it
-            encoded_chars = []
-            while id_int > 0:
-                id_int, remainder = divmod(id_int, cls.ALPHABET_LEN)
-                encoded_chars.append(cls.ALPHABET[remainder])
-            encoded = "".join(reversed(encoded_chars))
+            if cls.ORDERED:
+                # Generate a new UUID
+                id_int = uuid.uuid7().int
+
+                # Base36 encode it, stripping the leading zeros
+                # that may be left in the most significant chunk
+                chunk_base, chunk_table = cls._CHUNK_BASE, cls._CHUNK_TABLE
+                encoded_chunks = []
+                while id_int > 0:
+                    id_int, remainder = divmod(id_int, chunk_base)
+                    encoded_chunks.append(chunk_table[remainder])
+                encoded = "".join(reversed(encoded_chunks)).lstrip("0")
+            else:
+                # 16 random bytes, base64url encoded without padding
+                encoded = secrets.token_urlsafe(16)
 
             # Build the full prefixed ID and initialize str with it
-            prefixed_id = f"{cls.PREFIX}{cls.PREFIX_SEPARATOR}{encoded}"
+            prefixed_id = f"{cls._full_prefix}{encoded}"
             return super().__new__(cls, prefixed_id)
         else:
             # Validate encoded_id
-            expected_prefix = cls.PREFIX + cls.PREFIX_SEPARATOR
-            if not encoded_id.startswith(expected_prefix):
+            if not encoded_id.startswith(cls._full_prefix):
                 raise ValueError(
                     f"Encoded ID {encoded_id} does not have expected prefix {cls.PREFIX}"
                 )
@@ -110,6 +140,21 @@ class BaseID(str):
         """
         return f"{self.__class__.__name__}('{self.__str__()}')"
 
+    @property
+    def created_at(self) -> datetime:
+        """
+        Returns when this ID was generated, to the millisecond. Raises
+        `ValueError` if the class is not ORDERED, or if the ID was not
+        encoded from a UUID.
+        """
+        if not self.ORDERED:
+            raise ValueError(f"{self.__class__.__name__} IDs are not ordered.")
+        id_int = int(self[len(self._full_prefix) :], 36)
+        if not 0 <= id_int < 1 << 128:
+            raise ValueError(f"ID '{self}' was not encoded from a UUID.")
+        # The first 48 bits of a UUIDv7 are the Unix time in milliseconds
+        return datetime.fromtimestamp((id_int >> 80) / 1000, timezone.utc)
+
     def __init_subclass__(cls):
         """
         Called when new subclasses are initialized. This is where we ensure
@@ -120,6 +165,11 @@ class BaseID(str):
                 "ID classes must define a class property named"
                 "`PREFIX` set to a unique prefix string."
             )
+        if cls.PREFIX_SEPARATOR in cls.PREFIX:
+            raise ValueError(
+                f"The ID prefix '{cls.PREFIX}' must not contain"
+                f" the prefix separator '{cls.PREFIX_SEPARATOR}'."
+            )
         if cls.PREFIX in cls.prefix_to_class_map:
             raise ValueError(
                 f"The ID prefix '{cls.PREFIX}' is used on both"
@@ -127,6 +177,7 @@ class BaseID(str):
                 " ID prefixes must be unique across the set of all ID classes."
             )
         cls.prefix_to_class_map[cls.PREFIX] = cls
+        cls._full_prefix = cls.PREFIX + cls.PREFIX_SEPARATOR
         return super().__init_subclass__()
 
     @classmethod
@@ -136,10 +187,10 @@ class BaseID(str):
         class ID instance. If the prefix does not match any of the
         registered ones, this raises `ValueError`.
         """
-        for prefix, cls in cls.prefix_to_class_map.items():
-            if encoded_id.startswith(prefix):
-                return cls(encoded_id)
-
-        raise ValueError(
-            f"The prefix of ID '{encoded_id}' does not match a known ID prefix."
-        )
+        prefix, separator, _ = encoded_id.partition(cls.PREFIX_SEPARATOR)
+        id_class = cls.prefix_to_class_map.get(prefix)
+        if not separator or id_class is None:
+            raise ValueError(
+                f"The prefix of ID '{encoded_id}' does not match a known ID prefix."
+            )
+        return id_class(encoded_id)
@@ -0,0 +1,112 @@
+import time
+from base64 import urlsafe_b64decode
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from .ids import BaseID
+
+
+class OrderedTestID(BaseID):
+    PREFIX = "ordtest"
+
+
+class RandomTestID(BaseID):
+    PREFIX = "rndtest"
+    ORDERED = False
+
+
+def base36_decode(encoded: str) -> int:
+    return int(encoded, 36)
+
+
+def test_new_id_has_prefix() -> None:
+    id = OrderedTestID()
+    assert isinstance(id, OrderedTestID)
+    assert id.startswith("ordtest_")
+
+
+def test_new_ordered_id_is_base36() -> None:
+    encoded = OrderedTestID().partition(BaseID.PREFIX_SEPARATOR)[2]
+    assert len(encoded) > 0
+    assert all(c in BaseID.ALPHABET for c in encoded)
+    assert not encoded.startswith("0")
+    assert base36_decode(encoded) < 2**128
+
+
+def test_new_random_id_is_base64url() -> None:
+    encoded = RandomTestID().partition(BaseID.PREFIX_SEPARATOR)[2]
+    assert len(urlsafe_b64decode(encoded + "==")) == 16
+
+
+def test_ordered_ids_sort_by_creation() -> None:
+    ids = []
+    for _ in range(10):
+        ids.append(OrderedTestID())
+        time.sleep(0.002)
+    assert sorted(ids) == ids
+
+
+def test_random_ids_are_unique() -> None:
+    ids = {RandomTestID() for _ in range(100)}
+    assert len(ids) == 100
+
+
+def test_rehydrate() -> None:
+    id = OrderedTestID()
+    rehydrated = OrderedTestID(str(id))
+    assert rehydrated == id
+    assert isinstance(rehydrated, OrderedTestID)
+
+
+def test_rehydrate_wrong_prefix_raises() -> None:
+    with pytest.raises(ValueError):
+        OrderedTestID(str(RandomTestID()))
+
+
+def test_parse() -> None:
+    id = RandomTestID()
+    parsed = BaseID.parse(str(id))
+    assert parsed == id
+    assert type(parsed) is RandomTestID
+
+
+def test_parse_unknown_prefix_raises() -> None:
+    with pytest.raises(ValueError):
+        BaseID.parse("unknown_abc123")
+
+    with pytest.raises(ValueError):
+        BaseID.parse("ordtest")  # no separator
+
+
+def test_duplicate_prefix_raises() -> None:
+    with pytest.raises(ValueError):
+
+        class DuplicateTestID(BaseID):
+            PREFIX = "ordtest"
+
+
+def test_prefix_with_separator_raises() -> None:
+    with pytest.raises(ValueError):
+
+        class SeparatorTestID(BaseID):
+            PREFIX = "sep_test"
+
+
+def test_created_at() -> None:
+    before = datetime.now(timezone.utc)
+    id = OrderedTestID()
+    after = datetime.now(timezone.utc)
+    # created_at is truncated to the millisecond
+    assert before - timedelta(milliseconds=1) <= id.created_at <= after
+
+
+def test_created_at_invalid_raises() -> None:
+    with pytest.raises(ValueError):
+        RandomTestID().created_at
+
+    with pytest.raises(ValueError):
+        OrderedTestID("ordtest_not-base36").created_at
+
+    with pytest.raises(ValueError):
+        OrderedTestID("ordtest_zzzzzzzzzzzzzzzzzzzzzzzzzzzzzz").created_at
@@ -1,6 +1,7 @@
 from dataclasses import dataclass, fields
 from enum import Enum
-from typing import Type
+from functools import cache
+from typing import Any, Callable, Type
 
 
 @dataclass(frozen=True)
@@ -13,15 +14,35 @@ class Dialect(Enum):
 
 
 class SqlGenerator:
+    __slots__ = (
+        "dialect",
+        "table_name",
+        "id_name",
+        "column_names",
+        "column_list",
+        "placeholder_list",
+        "insert_sql",
+        "select_all_sql",
+        "select_by_id_sql",
+        "delete_by_id_sql",
+        "insert_params",
+        "_placeholder",
+        "_select_by_column_sql",
+    )
+
     dialect: Dialect
     table_name: str
     id_name: str
+    column_names: tuple[str, ...]
     column_list: str
     placeholder_list: str
     insert_sql: str
     select_all_sql: str
     select_by_id_sql: str
     delete_by_id_sql: str
+    insert_params: Callable[[Any], tuple[Any, ...]]
+    _placeholder: str
+    _select_by_column_sql: dict[str, str]
 
     def __init__(
         self,
@@ -29,19 +50,76 @@ class SqlGenerator:
         datacls: Type,
         id_name: str = "id",
         dialect: Dialect = Dialect.POSTGRES,
+        new_datacls: Type | None = None,
     ) -> None:
+        """
+        Generates all the SQL for the table and dataclass up front.
+
+        If the table fills some columns with defaults, pass the dataclass
+        for new rows in `new_datacls`. The `insert_sql` then inserts only
+        its fields and returns all the columns of the new row.
+
+        Use `insert_params(record)` to get the parameters for `insert_sql`
+        from an instance of the dataclass, in the same column order.
+        """
         self.dialect = dialect
         self.table_name = table_name
         self.id_name = id_name
-        datacls_fields = fields(datacls)
-        self.column_list = ",".join([f.name for f in datacls_fields])
-        self.placeholder_list = ",".join(
-            [dialect.value.placeholder] * len(datacls_fields)
+        self._placeholder = dialect.value.placeholder
+        column_names = tuple(f.name for f in fields(datacls))
+        self.column_names = column_names
+        self.column_list = ",".join(column_names)
+        self.placeholder_list = ",".join([self._placeholder] * len(column_names))
+        insert_column_names = (
+            column_names
+            if new_datacls is None
+            else tuple(f.name for f in fields(new_datacls))
         )
-        self.insert_sql = f"insert into {self.table_name} ({self.column_list}) values ({self.placeholder_list})"
+        self.insert_sql = (
+            f"insert into {self.table_name} ({','.join(insert_column_names)})"
+            f" values ({','.join([self._placeholder] * len(insert_column_names))})"
+        )
+        if new_datacls is not None:
+            self.insert_sql += f" returning {self.column_list}"
         self.select_all_sql = f"select {self.column_list} from {self.table_name}"
-        self.select_by_id_sql = f"{self.select_all_sql} where {self.id_name}={self.dialect.value.placeholder}"
-        self.delete_by_id_sql = f"delete from {self.table_name} where {self.id_name}={self.dialect.value.placeholder}"
+        self.select_by_id_sql = (
+            f"{self.select_all_sql} where {self.id_name}={self._placeholder}"
+        )
+        self.delete_by_id_sql = (
+            f"delete from {self.table_name} where {self.id_name}={self._placeholder}"
+        )
+        # Generate a function that reads each field directly, like the ones
+        # dataclasses generates, which is faster than even attrgetter.
+        # The names come from dataclass fields, so they are identifiers.
+        self.insert_params = eval(
+            f"lambda record: ({''.join(f'record.{n},' for n in insert_column_names)})",
+            {},
+        )
+        self._select_by_column_sql = {
+            column_name: f"{self.select_all_sql} where {column_name}={self._placeholder}"
+            for column_name in column_names
+        }
+
+    @classmethod
+    @cache
+    def get(
+        cls,
+        table_name: str,
+        datacls: Type,
+        id_name: str = "id",
+        dialect: Dialect = Dialect.POSTGRES,
+        new_datacls: Type | None = None,
+    ) -> "SqlGenerator":
+        """
+        Returns a shared SqlGenerator for these arguments, creating it
+        only the first time. Use this instead of the constructor.
+        """
+        return cls(table_name, datacls, id_name, dialect, new_datacls)
 
     def select_by_column(self, column_name: str) -> str:
-        return f"{self.select_all_sql} where {column_name}={self.dialect.value.placeholder}"
+        try:
+            return self._select_by_column_sql[column_name]
+        except KeyError:
+            raise ValueError(
+                f"'{column_name}' is not a column of {self.table_name}"
+            ) from None
@@ -1,8 +1,15 @@
-import hashlib
-from base64 import urlsafe_b64decode, urlsafe_b64encode
+from base64 import urlsafe_b64decode
+from binascii import b2a_base64
 from collections.abc import Sequence
-from hmac import HMAC, compare_digest
-from random import randint
+from hmac import compare_digest
+from secrets import randbelow
+from typing import Final
+
+from cryptography.hazmat.primitives.hashes import SHA256
+from cryptography.hazmat.primitives.hmac import HMAC
+
+# Maps standard base64 to the base64url alphabet.
+_URLSAFE_TRANSLATION: Final = bytes.maketrans(b"+/", b"-_")
 
 
 class InvalidTokenError(Exception):
@@ -25,13 +32,36 @@ class Token(str):
 
 
 class TokenSigner:
+    __slots__ = (
+        "_signing_keys",
+        "_num_signing_keys",
+        "_single_key",
+        "_key_index_bytes",
+        "_hmac_templates",
+    )
+
+    MIN_TOKEN_LENGTH: Final = 48
+    """
+    Length of the shortest possible token: a key index byte, a 32-byte
+    digest, and a 1-byte payload, base64url encoded. Anything shorter
+    can be rejected without decoding it.
+    """
+
     _signing_keys: Sequence[bytes]
+    _hmac_templates: Sequence[HMAC]
 
     def __init__(self, signing_keys: Sequence[bytes]):
         self._signing_keys = signing_keys
         self._num_signing_keys = len(signing_keys)
         if self._num_signing_keys == 0:
             raise ValueError("signing_keys must include at least one key")
+        self._single_key = self._num_signing_keys == 1
+        self._key_index_bytes = [bytes((i,)) for i in range(self._num_signing_keys)]
+        # HMAC objects already keyed with each signing key. Copying one
+        # of these is cheaper than setting up the key on every call.
+        # These come from `cryptography`, which calls straight into
+        # OpenSSL without the Python wrapper of the stdlib `hmac` module.
+        self._hmac_templates = [HMAC(key, SHA256()) for key in signing_keys]
 
     def sign(self, payload: bytes | str, payload_str_encoding: str = "utf-8") -> Token:
         normalized_payload = (
@@ -39,15 +69,22 @@ class TokenSigner:
             if isinstance(payload, str)
             else payload
         )
-        key_index = randint(0, self._num_signing_keys - 1)
-        key = self._signing_keys[key_index]
-        hmac = HMAC(key=key, msg=normalized_payload, digestmod=hashlib.sha256)
-        digest = hmac.digest()
+        key_index = 0 if self._single_key else randbelow(self._num_signing_keys)
+        hmac = self._hmac_templates[key_index].copy()
+        hmac.update(normalized_payload)
+        digest = hmac.finalize()
 
-        combined = key_index.to_bytes(1) + digest + normalized_payload
-        return Token(urlsafe_b64encode(combined).decode("ascii"))
+        combined = b"".join(
+            (self._key_index_bytes[key_index], digest, normalized_payload)
+        )
+        # Same output as urlsafe_b64encode(), minus its Python-level wrappers.
+        encoded = b2a_base64(combined, newline=False).translate(_URLSAFE_TRANSLATION)
+        return Token(encoded.decode("ascii"))
 
     def verify(self, token: Token) -> bytes:
+        if len(token) < self.MIN_TOKEN_LENGTH:
+            raise InvalidTokenError()
+
         try:
             decoded = urlsafe_b64decode(token)
         except ValueError as e:
@@ -56,16 +93,19 @@ class TokenSigner:
         if len(decoded) < 34:
             raise InvalidTokenError()
 
-        key_index = decoded[0]
-        if key_index >= self._num_signing_keys:
-            raise InvalidTokenError
-
-        key = self._signing_keys[key_index]
-        digest = decoded[1:33]
-        payload = decoded[33:]
-        hmac = HMAC(key=key, msg=payload, digestmod=hashlib.sha256)
-        recalculated_digest = hmac.digest()
-        if compare_digest(digest, recalculated_digest):
-            return payload
+        # Slice through a memoryview so the digest and payload
+        # are not copied just to compute and compare the HMAC.
+        view = memoryview(decoded)
+
+        # An out-of-range key index is rejected the same way as a bad
+        # signature, after doing the same work, so the two failures
+        # can't be told apart by their timing.
+        key_index = view[0]
+        is_valid_key_index = key_index < self._num_signing_keys
+        hmac = self._hmac_templates[key_index if is_valid_key_index else 0].copy()
+        hmac.update(view[33:])
+        recalculated_digest = hmac.finalize()
+        if compare_digest(view[1:33], recalculated_digest) & is_valid_key_index:
+            return bytes(view[33:])
         else:
             raise InvalidSignatureError()
@@ -56,7 +56,7 @@ def test_invalid_key_index_raises(signer: TokenSigner) -> None:
     invalid_key_index = signer._num_signing_keys
     tampered_decoded = invalid_key_index.to_bytes(1) + decoded[1:]
     tampered_token = urlsafe_b64encode(tampered_decoded).decode("ascii")
-    with pytest.raises(InvalidTokenError):
+    with pytest.raises(InvalidSignatureError):
         signer.verify(Token(tampered_token))
 
 
@@ -90,3 +90,13 @@ def test_one_key() -> None:
 def test_zero_keys_raises() -> None:
     with pytest.raises(ValueError):
         TokenSigner([])
+
+
+def test_min_token_length() -> None:
+    signer = TokenSigner([b"test key"])
+    token = signer.sign(b"x")
+    assert len(token) == TokenSigner.MIN_TOKEN_LENGTH
+    assert signer.verify(token) == b"x"
+
+    with pytest.raises(InvalidTokenError):
+        signer.verify(Token(token[:-1]))
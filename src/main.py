@@ -2,9 +2,10 @@ from fastapi import FastAPI
 from fastapi.responses import FileResponse
 
 from src.api import susi
+from src.api.responses import UTCORJSONResponse
 from src.dependencies import lifespan
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=UTCORJSONResponse)
 app.include_router(susi.router)
 
 
@@ -1,13 +1,17 @@
-import secrets
+import asyncio
+import os
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
+from typing import Any
 
+from cachetools import TTLCache
 from webauthn import (
     generate_authentication_options,
     generate_registration_options,
     verify_authentication_response,
     verify_registration_response,
 )
+from webauthn.helpers import options_to_json_dict
 from webauthn.helpers.structs import (
     AuthenticationCredential,
     PublicKeyCredentialCreationOptions,
@@ -21,7 +25,9 @@ from src.services.identity.stores.identity_store import (
     AccountID,
     AccountRecord,
     ChallengeID,
+    ChallengeRecord,
     CredentialType,
+    CredentialUseRecord,
     IdentityStore,
     NewAccountRecord,
     NewChallengeRecord,
@@ -30,6 +36,9 @@ from src.services.identity.stores.identity_store import (
     NewSessionRecord,
 )
 
+# WebAuthn requires challenges of at least 16 random bytes.
+_CHALLENGE_NUM_BYTES = 32
+
 
 @dataclass(frozen=True)
 class NewAccount:
@@ -61,6 +70,7 @@ class CreateAccountOutcome:
     account: Account
     challenge_id: ChallengeID
     passkey_creation_options: PublicKeyCredentialCreationOptions
+    passkey_creation_options_json: dict[str, Any]
 
 
 @dataclass(frozen=True)
@@ -68,6 +78,7 @@ class RegistrationChallenge:
     account_id: AccountID
     challenge_id: ChallengeID
     passkey_creation_options: PublicKeyCredentialCreationOptions
+    passkey_creation_options_json: dict[str, Any]
 
 
 @dataclass(frozen=True)
@@ -75,6 +86,7 @@ class AuthenticateChallenge:
     account_id: AccountID
     challenge_id: ChallengeID
     passkey_authentication_options: PublicKeyCredentialRequestOptions
+    passkey_authentication_options_json: dict[str, Any]
 
 
 @dataclass(frozen=True)
@@ -117,6 +129,11 @@ class IdentityService:
     _relying_party_name: str
     _session_token_signer: TokenSigner
     _origins: list[str]
+    _accounts_by_id: TTLCache[str, AccountRecord]
+    _accounts_by_email: TTLCache[str, AccountRecord]
+    _challenges: TTLCache[str, ChallengeRecord]
+    _credential_ids: TTLCache[str, tuple[bytes, ...]]
+    _credential_ids_version: int
 
     def __init__(
         self,
@@ -127,6 +144,9 @@ class IdentityService:
         session_signing_keys: list[bytes],
         challenge_duration: timedelta = timedelta(minutes=2),
         session_duration: timedelta = timedelta(days=1),
+        account_cache_size: int = 10_000,
+        account_cache_ttl: timedelta = timedelta(minutes=1),
+        challenge_cache_size: int = 50_000,
     ):
         """
         Creates a new instance of the service.
@@ -144,6 +164,13 @@ class IdentityService:
                 (defaults to 2 minutes).
             session_duration: How long authenticated sessions should last
                 (defaults to 1 day).
+            account_cache_size: How many accounts, and their credential IDs,
+                to keep cached in memory (defaults to 10,000).
+            account_cache_ttl: How long a cached account or its credential
+                IDs may be used before they are read from the store again
+                (defaults to 1 minute).
+            challenge_cache_size: How many new challenges to keep in memory
+                until they are used or expire (defaults to 50,000).
         """
         self._store = store
         self._challenge_duration = challenge_duration
@@ -152,15 +179,35 @@ class IdentityService:
         self._origins = origins
         self._session_token_signer = TokenSigner(session_signing_keys)
         self._session_duration = session_duration
+        self._accounts_by_id = TTLCache(
+            maxsize=account_cache_size, ttl=account_cache_ttl.total_seconds()
+        )
+        self._accounts_by_email = TTLCache(
+            maxsize=account_cache_size, ttl=account_cache_ttl.total_seconds()
+        )
+        self._credential_ids = TTLCache(
+            maxsize=account_cache_size, ttl=account_cache_ttl.total_seconds()
+        )
+        self._credential_ids_version = 0
+        # Process-local shortcut for reading back challenges this process
+        # created, which only saves a read. Challenges are still written to
+        # the store, not handed to the client as signed tokens, because
+        # registration only adds the credential if it can delete the
+        # challenge from the store, and that enforces single use across
+        # every process.
+        self._challenges = TTLCache(
+            maxsize=challenge_cache_size, ttl=challenge_duration.total_seconds()
+        )
 
     async def create_account(self, new_account: NewAccount) -> CreateAccountOutcome:
         """
         Creates a new Account and new passkey registration options.
 
-        Serialize the registration options to the client as JSON using the
-        `options_to_json_dict()` helper method from the webauthn library.
-        Use the add_passkey_credential() method to add the passkey when
-        the client posts the response from the authenticator.
+        The registration options are also returned already converted
+        to a JSON-ready dict, so send `passkey_creation_options_json`
+        to the client as-is. Use the add_passkey_credential() method to
+        add the passkey when the client posts the response from the
+        authenticator.
         """
         new_account_record = NewAccountRecord(
             id=AccountID(),
@@ -169,7 +216,7 @@ class IdentityService:
         )
         new_challenge_record = NewChallengeRecord(
             id=ChallengeID(),
-            value=secrets.token_bytes(64),
+            value=os.urandom(_CHALLENGE_NUM_BYTES),
             account_id=new_account_record.id,
             expires_at=datetime.now(timezone.utc) + self._challenge_duration,
         )
@@ -181,6 +228,8 @@ class IdentityService:
         assert outcome.challenge is not None
         account_record = outcome.account
         challenge_record = outcome.challenge
+        self._cache_account(account_record)
+        self._challenges[challenge_record.id] = challenge_record
 
         passkey_creation_options = generate_registration_options(
             rp_id=self._relying_party_id,
@@ -195,6 +244,9 @@ class IdentityService:
             account=Account.from_record(outcome.account),
             challenge_id=new_challenge_record.id,
             passkey_creation_options=passkey_creation_options,
+            passkey_creation_options_json=options_to_json_dict(
+                passkey_creation_options
+            ),
         )
 
     async def create_registration_challenge(
@@ -205,17 +257,18 @@ class IdentityService:
 
         Use this when adding another passkey to an existing account.
         """
-        account_record = await self._store.get_account_by_id(account_id)
+        account_record = await self._get_account_by_id(account_id)
         if account_record is None:
             raise InvalidAccountError(f"Account ID '{account_id}' not found.")
 
         new_challenge_record = NewChallengeRecord(
             id=ChallengeID(),
-            value=secrets.token_bytes(64),
+            value=os.urandom(_CHALLENGE_NUM_BYTES),
             account_id=account_id,
             expires_at=datetime.now(timezone.utc) + self._challenge_duration,
         )
         challenge_record = await self._store.create_challenge(new_challenge_record)
+        self._challenges[challenge_record.id] = challenge_record
         passkey_creation_options = generate_registration_options(
             rp_id=self._relying_party_id,
             rp_name=self._relying_party_name,
@@ -228,6 +281,9 @@ class IdentityService:
             account_id=account_id,
             challenge_id=challenge_record.id,
             passkey_creation_options=passkey_creation_options,
+            passkey_creation_options_json=options_to_json_dict(
+                passkey_creation_options
+            ),
         )
 
     async def add_passkey_credential(
@@ -242,11 +298,17 @@ class IdentityService:
         """
         # Ensure the challenge was connected to the account
         # and not yet expired.
-        challenge = await self._store.get_challenge(challenge_id)
+        if self._challenge_id_expired(challenge_id):
+            raise ChallengeExpiredError()
+        challenge = await self._use_challenge(challenge_id)
         if challenge is None or challenge.account_id != account_id:
             raise ChallengeExpiredError()
 
-        verified = verify_registration_response(
+        # Verification parses CBOR and checks signatures, so keep it off
+        # the event loop. The cryptography library releases the GIL while
+        # verifying, so other threads and requests can run meanwhile.
+        verified = await asyncio.to_thread(
+            verify_registration_response,
             credential=credential,
             expected_challenge=challenge.value,
             expected_rp_id=self._relying_party_id,
@@ -258,7 +320,15 @@ class IdentityService:
             type=CredentialType.PASSKEY,
             value=verified.credential_public_key,
         )
-        await self._store.create_credential(new_credential, challenge_id)
+        # The store only creates the credential if it can delete the
+        # challenge, which enforces single use across every process.
+        credential_record = await self._store.create_credential(
+            new_credential, challenge_id
+        )
+        if credential_record is None:
+            raise ChallengeExpiredError()
+        self._credential_ids.pop(account_id, None)
+        self._credential_ids_version += 1
 
     async def create_authentication_challenge(
         self, email: str
@@ -272,20 +342,35 @@ class IdentityService:
         the authenticator's response, call the `authenticate()` method to
         complete authentication.
         """
-        account = await self._store.get_account_by_email(email)
+        account = await self._get_account_by_email(email)
         if account is None:
             raise InvalidAccountError(f"No account with email `{email}`")
         new_challenge = NewChallengeRecord(
             id=ChallengeID(),
-            value=secrets.token_bytes(64),
+            value=os.urandom(_CHALLENGE_NUM_BYTES),
             account_id=account.id,
             expires_at=datetime.now(timezone.utc) + self._challenge_duration,
         )
-        await self._store.create_challenge(new_challenge)
-        existing_credentials = await self._store.get_account_credentials(account.id)
-        allow_credentials = [
-            PublicKeyCredentialDescriptor(c.id) for c in existing_credentials
-        ]
+        # Only the credential IDs are needed here, and they change only when
+        # a passkey is added, so they are cached along with the account.
+        # Other processes will see a new passkey once their entry expires.
+        credential_ids = self._credential_ids.get(account.id)
+        if credential_ids is None:
+            version = self._credential_ids_version
+            # These are independent, so run them concurrently.
+            challenge_record, existing_credentials = await asyncio.gather(
+                self._store.create_challenge(new_challenge),
+                self._store.get_account_credentials(account.id),
+            )
+            credential_ids = tuple(c.id for c in existing_credentials)
+            # If a passkey was added while reading, these IDs may predate it,
+            # so only cache them when no entry was invalidated meanwhile.
+            if version == self._credential_ids_version:
+                self._credential_ids[account.id] = credential_ids
+        else:
+            challenge_record = await self._store.create_challenge(new_challenge)
+        self._challenges[challenge_record.id] = challenge_record
+        allow_credentials = [PublicKeyCredentialDescriptor(id) for id in credential_ids]
         passkey_authentication_options = generate_authentication_options(
             challenge=new_challenge.value,
             rp_id=self._relying_party_id,
@@ -295,6 +380,9 @@ class IdentityService:
             account_id=account.id,
             challenge_id=new_challenge.id,
             passkey_authentication_options=passkey_authentication_options,
+            passkey_authentication_options_json=options_to_json_dict(
+                passkey_authentication_options
+            ),
         )
 
     async def authenticate(
@@ -307,11 +395,28 @@ class IdentityService:
         Verifies the `AuthenticationCredential` against the specified challenge
         for the specified account, and completes authentication.
         """
-        account_record = await self._store.get_account_by_id(account_id)
+        if self._challenge_id_expired(challenge_id):
+            raise ChallengeExpiredError()
+
+        # The account and challenge are usually cached, leaving just the
+        # credential to read. Otherwise, read all three in one call.
+        account_record = self._accounts_by_id.get(account_id)
+        challenge_record = self._take_cached_challenge(challenge_id)
+        if account_record is None or challenge_record is None:
+            context = await self._store.get_auth_context(
+                account_id, credential.raw_id, challenge_id
+            )
+            account_record = context.account
+            credential_record = context.credential
+            challenge_record = context.challenge
+            if account_record is not None:
+                self._cache_account(account_record)
+        else:
+            credential_record = await self._store.get_credential(credential.raw_id)
+
         if account_record is None:
             raise InvalidAccountError(f"No account with id `{account_id}`")
 
-        credential_record = await self._store.get_credential(credential.raw_id)
         if (
             credential_record is None
             or credential_record.account_id != account_record.id
@@ -320,11 +425,11 @@ class IdentityService:
                 f"The credential {credential.id} does not exist for the specified account."
             )
 
-        challenge_record = await self._store.get_challenge(challenge_id)
         if challenge_record is None or challenge_record.account_id != account_record.id:
             raise ChallengeExpiredError()
 
-        verified = verify_authentication_response(
+        verified = await asyncio.to_thread(
+            verify_authentication_response,
             credential=credential,
             expected_challenge=challenge_record.value,
             expected_rp_id=self._relying_party_id,
@@ -333,16 +438,17 @@ class IdentityService:
             credential_current_sign_count=credential_record.use_count,
         )
 
-        await self._store.update_credential_use_count(
-            credential_record.id, verified.new_sign_count
-        )
-
         new_session = NewSessionRecord(
             id=SessionID(),
             account_id=account_record.id,
             expires_at=datetime.now(timezone.utc) + self._session_duration,
         )
-        session = await self._store.create_session(new_session)
+        session = await self._store.create_session(
+            new_session,
+            used_credential=CredentialUseRecord(
+                id=credential_record.id, use_count=verified.new_sign_count
+            ),
+        )
         token = self._session_token_signer.sign(session.id.encode("ascii"))
 
         return Session(
@@ -371,3 +477,61 @@ class IdentityService:
             ),
             expires_at=session_with_account_record.expires_at,
         )
+
+    # Accounts are read at the start of every ceremony but only change
+    # when created, so recently-used ones are kept in memory. Misses are
+    # not cached, since the account may be created by another process.
+    async def _get_account_by_id(self, account_id: AccountID) -> AccountRecord | None:
+        account = self._accounts_by_id.get(account_id)
+        if account is None:
+            account = await self._store.get_account_by_id(account_id)
+            if account is not None:
+                self._cache_account(account)
+        return account
+
+    async def _get_account_by_email(self, email: str) -> AccountRecord | None:
+        account = self._accounts_by_email.get(email)
+        if account is None:
+            account = await self._store.get_account_by_email(email)
+            if account is not None:
+                self._cache_account(account)
+        return account
+
+    def _cache_account(self, account: AccountRecord) -> None:
+        self._accounts_by_id[account.id] = account
+        self._accounts_by_email[account.email] = account
+
+    async def _use_challenge(self, challenge_id: ChallengeID) -> ChallengeRecord | None:
+        """
+        Returns the unexpired challenge, removing it from the in-memory cache.
+        Challenges are read back once, usually by the process that created
+        them, so this only falls back to the store on another process.
+        A cached challenge may already have been used by another process,
+        so callers must still delete it from the store to use it.
+        """
+        challenge = self._take_cached_challenge(challenge_id)
+        if challenge is None:
+            return await self._store.get_challenge(challenge_id)
+        return challenge
+
+    def _challenge_id_expired(self, challenge_id: ChallengeID) -> bool:
+        """
+        Returns True if the challenge must have expired, judging by when
+        its ordered ID was generated, so it can be rejected without reading
+        the store. The store still checks expires_at on challenges that pass.
+        """
+        try:
+            created_at = challenge_id.created_at
+        except ValueError:
+            # Not a challenge ID this service could have generated
+            return True
+        return datetime.now(timezone.utc) - created_at > self._challenge_duration
+
+    def _take_cached_challenge(
+        self, challenge_id: ChallengeID
+    ) -> ChallengeRecord | None:
+        challenge = self._challenges.pop(challenge_id, None)
+        # The cache TTL starts slightly after expires_at was computed
+        if challenge is None or challenge.expires_at <= datetime.now(timezone.utc):
+            return None
+        return challenge
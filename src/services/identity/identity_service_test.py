@@ -0,0 +1,508 @@
+import asyncio
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Any, Sequence, cast
+
+import pytest
+from uuid_utils import uuid7
+from webauthn.helpers.structs import AuthenticationCredential, RegistrationCredential
+
+from src.services.identity import identity_service as identity_service_module
+from src.services.identity.identity_service import (
+    ChallengeExpiredError,
+    IdentityService,
+    InvalidAccountError,
+    InvalidCredentialError,
+    NewAccount,
+)
+from src.services.identity.stores.identity_store import (
+    AccountID,
+    AccountRecord,
+    AuthContextRecord,
+    ChallengeID,
+    ChallengeRecord,
+    CreateAccountOutcome,
+    CredentialRecord,
+    CredentialUseRecord,
+    NewAccountRecord,
+    NewChallengeRecord,
+    NewCredentialRecord,
+    NewSessionRecord,
+    SessionID,
+    SessionRecord,
+    SessionWithAccountRecord,
+)
+
+
+class FakeIdentityStore:
+    """
+    In-memory IdentityStore that records the name of each method called.
+    """
+
+    def __init__(self) -> None:
+        self.calls: list[str] = []
+        self.accounts: dict[str, AccountRecord] = {}
+        self.challenges: dict[str, ChallengeRecord] = {}
+        self.credentials: dict[bytes, CredentialRecord] = {}
+        self.sessions: dict[str, SessionRecord] = {}
+        # When set, get_account_credentials waits on this after reading
+        self.credentials_read: asyncio.Event | None = None
+
+    async def create_account(
+        self,
+        new_account: NewAccountRecord,
+        new_challenge: NewChallengeRecord | None = None,
+    ) -> CreateAccountOutcome:
+        self.calls.append("create_account")
+        now = datetime.now(timezone.utc)
+        account = AccountRecord(
+            id=new_account.id,
+            email=new_account.email,
+            display_name=new_account.display_name,
+            created_at=now,
+            updated_at=now,
+            version=0,
+        )
+        self.accounts[account.id] = account
+        challenge = None
+        if new_challenge is not None:
+            challenge = self._insert_challenge(new_challenge)
+        return CreateAccountOutcome(account=account, challenge=challenge)
+
+    async def get_account_by_id(self, id: AccountID) -> AccountRecord | None:
+        self.calls.append("get_account_by_id")
+        return self.accounts.get(id)
+
+    async def get_account_by_email(self, email: str) -> AccountRecord | None:
+        self.calls.append("get_account_by_email")
+        return next((a for a in self.accounts.values() if a.email == email), None)
+
+    async def create_challenge(
+        self, new_challenge: NewChallengeRecord
+    ) -> ChallengeRecord:
+        self.calls.append("create_challenge")
+        return self._insert_challenge(new_challenge)
+
+    async def delete_challenge(self, challenge: bytes) -> None:
+        self.calls.append("delete_challenge")
+
+    async def get_challenge(
+        self, id: ChallengeID, include_expired: bool = False
+    ) -> ChallengeRecord | None:
+        self.calls.append("get_challenge")
+        challenge = self.challenges.get(id)
+        if challenge is None or (
+            not include_expired and challenge.expires_at <= datetime.now(timezone.utc)
+        ):
+            return None
+        return challenge
+
+    async def create_credential(
+        self,
+        new_credential: NewCredentialRecord,
+        source_challenge_id: ChallengeID | None = None,
+    ) -> CredentialRecord | None:
+        self.calls.append("create_credential")
+        if source_challenge_id is not None:
+            if self.challenges.pop(source_challenge_id, None) is None:
+                return None
+        credential = CredentialRecord(
+            id=new_credential.id,
+            account_id=new_credential.account_id,
+            type=new_credential.type,
+            value=new_credential.value,
+            use_count=0,
+            created_at=datetime.now(timezone.utc),
+            revoked_at=None,
+        )
+        self.credentials[credential.id] = credential
+        return credential
+
+    async def get_credential(self, id: bytes) -> CredentialRecord | None:
+        self.calls.append("get_credential")
+        return self.credentials.get(id)
+
+    async def get_account_credentials(
+        self, account_id: AccountID
+    ) -> Sequence[CredentialRecord]:
+        self.calls.append("get_account_credentials")
+        credentials = [
+            c for c in self.credentials.values() if c.account_id == account_id
+        ]
+        if self.credentials_read is not None:
+            await self.credentials_read.wait()
+        return credentials
+
+    async def get_auth_context(
+        self, account_id: AccountID, credential_id: bytes, challenge_id: ChallengeID
+    ) -> AuthContextRecord:
+        self.calls.append("get_auth_context")
+        account = self.accounts.get(account_id)
+        if account is None:
+            return AuthContextRecord(account=None, credential=None, challenge=None)
+        credential = self.credentials.get(credential_id)
+        challenge = self.challenges.get(challenge_id)
+        return AuthContextRecord(
+            account=account,
+            credential=(
+                credential
+                if credential is not None and credential.account_id == account_id
+                else None
+            ),
+            challenge=(
+                challenge
+                if challenge is not None
+                and challenge.account_id == account_id
+                and challenge.expires_at > datetime.now(timezone.utc)
+                else None
+            ),
+        )
+
+    async def update_credential_use_count(self, id: bytes, new_count: int) -> None:
+        self.calls.append("update_credential_use_count")
+        self._set_use_count(id, new_count)
+
+    async def create_session(
+        self,
+        new_session: NewSessionRecord,
+        used_credential: CredentialUseRecord | None = None,
+    ) -> SessionRecord:
+        self.calls.append("create_session")
+        if used_credential is not None:
+            self._set_use_count(used_credential.id, used_credential.use_count)
+        session = SessionRecord(
+            id=new_session.id,
+            account_id=new_session.account_id,
+            expires_at=new_session.expires_at,
+            created_at=datetime.now(timezone.utc),
+        )
+        self.sessions[session.id] = session
+        return session
+
+    async def get_session(
+        self, session_id: SessionID, included_expired: bool = False
+    ) -> SessionWithAccountRecord | None:
+        self.calls.append("get_session")
+        session = self.sessions.get(session_id)
+        if session is None or (
+            not included_expired and session.expires_at <= datetime.now(timezone.utc)
+        ):
+            return None
+        account = self.accounts[session.account_id]
+        return SessionWithAccountRecord(
+            id=session.id,
+            account_id=session.account_id,
+            created_at=session.created_at,
+            expires_at=session.expires_at,
+            account_email=account.email,
+            account_display_name=account.display_name,
+            account_created_at=account.created_at,
+            account_updated_at=account.updated_at,
+            account_version=account.version,
+        )
+
+    def _set_use_count(self, id: bytes, new_count: int) -> None:
+        if id in self.credentials:
+            self.credentials[id] = replace(self.credentials[id], use_count=new_count)
+
+    def _insert_challenge(self, new_challenge: NewChallengeRecord) -> ChallengeRecord:
+        challenge = ChallengeRecord(
+            id=new_challenge.id,
+            value=new_challenge.value,
+            account_id=new_challenge.account_id,
+            expires_at=new_challenge.expires_at,
+            created_at=datetime.now(timezone.utc),
+        )
+        self.challenges[challenge.id] = challenge
+        return challenge
+
+
+@pytest.fixture
+def store() -> FakeIdentityStore:
+    return FakeIdentityStore()
+
+
+def make_service(store: FakeIdentityStore) -> IdentityService:
+    return IdentityService(
+        store=store,
+        relying_party_id="localhost",
+        relying_party_name="Test",
+        origins=["https://localhost:8000"],
+        session_signing_keys=[b"test-signing-key"],
+    )
+
+
+@pytest.fixture
+def service(store: FakeIdentityStore) -> IdentityService:
+    return make_service(store)
+
+
+@pytest.fixture(autouse=True)
+def fake_verify_registration(monkeypatch: pytest.MonkeyPatch) -> None:
+    # Accept any registration, using the credential's raw_id as its ID
+    def verify(credential: Any, **kwargs: Any) -> Any:
+        return SimpleNamespace(
+            credential_id=credential.raw_id, credential_public_key=b"key"
+        )
+
+    monkeypatch.setattr(identity_service_module, "verify_registration_response", verify)
+
+
+@pytest.fixture(autouse=True)
+def fake_verify_authentication(monkeypatch: pytest.MonkeyPatch) -> None:
+    # Accept any authentication, counting one more use of the credential
+    def verify(credential_current_sign_count: int, **kwargs: Any) -> Any:
+        return SimpleNamespace(new_sign_count=credential_current_sign_count + 1)
+
+    monkeypatch.setattr(
+        identity_service_module, "verify_authentication_response", verify
+    )
+
+
+async def add_passkey(service: IdentityService, account_id: AccountID) -> bytes:
+    challenge = await service.create_registration_challenge(account_id)
+    credential_id = uuid7().bytes
+    await service.add_passkey_credential(
+        account_id,
+        challenge.challenge_id,
+        cast(RegistrationCredential, SimpleNamespace(raw_id=credential_id)),
+    )
+    return credential_id
+
+
+def allowed_ids(options: Any) -> set[bytes]:
+    return {c.id for c in options.allow_credentials}
+
+
+def assertion(credential_id: bytes) -> AuthenticationCredential:
+    return cast(
+        AuthenticationCredential,
+        SimpleNamespace(id=credential_id.hex(), raw_id=credential_id),
+    )
+
+
+def challenge_id_created_at(created_at: datetime) -> ChallengeID:
+    # Encode a UUIDv7-shaped int with this timestamp, as ChallengeID() would
+    id_int = int(created_at.timestamp() * 1000) << 80
+    encoded = ""
+    while id_int > 0:
+        id_int, remainder = divmod(id_int, ChallengeID.ALPHABET_LEN)
+        encoded = ChallengeID.ALPHABET[remainder] + encoded
+    return ChallengeID(f"{ChallengeID.PREFIX}_{encoded}")
+
+
+async def test_credential_ids_cached(
+    service: IdentityService, store: FakeIdentityStore
+) -> None:
+    outcome = await service.create_account(NewAccount("a@test.com", "Tester"))
+    credential_id = await add_passkey(service, outcome.account.id)
+
+    first = await service.create_authentication_challenge("a@test.com")
+    assert allowed_ids(first.passkey_authentication_options) == {credential_id}
+
+    store.calls.clear()
+    second = await service.create_authentication_challenge("a@test.com")
+    assert allowed_ids(second.passkey_authentication_options) == {credential_id}
+    assert "get_account_credentials" not in store.calls
+
+
+async def test_adding_passkey_invalidates_credential_ids(
+    service: IdentityService, store: FakeIdentityStore
+) -> None:
+    outcome = await service.create_account(NewAccount("a@test.com", "Tester"))
+    first_id = await add_passkey(service, outcome.account.id)
+    await service.create_authentication_challenge("a@test.com")
+
+    second_id = await add_passkey(service, outcome.account.id)
+    store.calls.clear()
+    challenge = await service.create_authentication_challenge("a@test.com")
+    assert "get_account_credentials" in store.calls
+    assert allowed_ids(challenge.passkey_authentication_options) == {
+        first_id,
+        second_id,
+    }
+
+
+async def test_passkey_added_during_read_is_not_cached_stale(
+    service: IdentityService, store: FakeIdentityStore
+) -> None:
+    outcome = await service.create_account(NewAccount("a@test.com", "Tester"))
+    first_id = await add_passkey(service, outcome.account.id)
+
+    # Read the credentials, but add a passkey before the read completes
+    store.credentials_read = asyncio.Event()
+    reading = asyncio.create_task(service.create_authentication_challenge("a@test.com"))
+    await asyncio.sleep(0)
+    second_id = await add_passkey(service, outcome.account.id)
+    store.credentials_read.set()
+    stale = await reading
+    assert allowed_ids(stale.passkey_authentication_options) == {first_id}
+
+    challenge = await service.create_authentication_challenge("a@test.com")
+    assert allowed_ids(challenge.passkey_authentication_options) == {
+        first_id,
+        second_id,
+    }
+
+
+async def test_cached_challenge_used_without_store_read(
+    service: IdentityService, store: FakeIdentityStore
+) -> None:
+    outcome = await service.create_account(NewAccount("a@test.com", "Tester"))
+    store.calls.clear()
+    challenge = await service._use_challenge(outcome.challenge_id)
+    assert challenge is not None
+    assert challenge.id == outcome.challenge_id
+    assert "get_challenge" not in store.calls
+
+
+async def test_second_challenge_use_reads_store(
+    service: IdentityService, store: FakeIdentityStore
+) -> None:
+    outcome = await service.create_account(NewAccount("a@test.com", "Tester"))
+    await service._use_challenge(outcome.challenge_id)
+    store.calls.clear()
+    challenge = await service._use_challenge(outcome.challenge_id)
+    assert challenge is not None
+    assert store.calls == ["get_challenge"]
+
+
+async def test_expired_cached_challenge_is_missing(
+    service: IdentityService, store: FakeIdentityStore
+) -> None:
+    outcome = await service.create_account(NewAccount("a@test.com", "Tester"))
+    challenge_id = outcome.challenge_id
+    expired = replace(
+        store.challenges[challenge_id],
+        expires_at=datetime.now(timezone.utc) - timedelta(seconds=1),
+    )
+    store.challenges[challenge_id] = expired
+    service._challenges[challenge_id] = expired
+    store.calls.clear()
+    assert await service._use_challenge(challenge_id) is None
+    assert challenge_id not in service._challenges
+    assert store.calls == ["get_challenge"]
+
+
+async def test_challenge_used_by_another_process_is_rejected(
+    service: IdentityService, store: FakeIdentityStore
+) -> None:
+    # A second service sharing the store stands in for another process
+    other_service = make_service(store)
+    outcome = await service.create_account(NewAccount("a@test.com", "Tester"))
+    account_id = outcome.account.id
+    await other_service.add_passkey_credential(
+        account_id,
+        outcome.challenge_id,
+        cast(RegistrationCredential, SimpleNamespace(raw_id=uuid7().bytes)),
+    )
+
+    # The challenge is still cached here, but the store already used it
+    with pytest.raises(ChallengeExpiredError):
+        await service.add_passkey_credential(
+            account_id,
+            outcome.challenge_id,
+            cast(RegistrationCredential, SimpleNamespace(raw_id=uuid7().bytes)),
+        )
+    assert len(store.credentials) == 1
+
+
+async def test_authenticate_with_cached_account_and_challenge(
+    service: IdentityService, store: FakeIdentityStore
+) -> None:
+    outcome = await service.create_account(NewAccount("a@test.com", "Tester"))
+    account_id = outcome.account.id
+    credential_id = await add_passkey(service, account_id)
+    challenge = await service.create_authentication_challenge("a@test.com")
+
+    store.calls.clear()
+    session = await service.authenticate(
+        account_id, challenge.challenge_id, assertion(credential_id)
+    )
+    assert session.account.id == account_id
+    assert store.calls == ["get_credential", "create_session"]
+    assert store.credentials[credential_id].use_count == 1
+    assert (await service.verify_session(session.token)).id == session.id
+
+
+async def test_authenticate_reads_auth_context_when_not_cached(
+    service: IdentityService, store: FakeIdentityStore
+) -> None:
+    outcome = await service.create_account(NewAccount("a@test.com", "Tester"))
+    account_id = outcome.account.id
+    credential_id = await add_passkey(service, account_id)
+    challenge = await service.create_authentication_challenge("a@test.com")
+
+    # A fresh service has neither the account nor the challenge cached
+    other_service = make_service(store)
+    store.calls.clear()
+    session = await other_service.authenticate(
+        account_id, challenge.challenge_id, assertion(credential_id)
+    )
+    assert session.account.id == account_id
+    assert store.calls == ["get_auth_context", "create_session"]
+    assert store.credentials[credential_id].use_count == 1
+    assert account_id in other_service._accounts_by_id
+
+
+async def test_authenticate_with_unknown_credential(
+    service: IdentityService, store: FakeIdentityStore
+) -> None:
+    outcome = await service.create_account(NewAccount("a@test.com", "Tester"))
+    await add_passkey(service, outcome.account.id)
+    challenge = await service.create_authentication_challenge("a@test.com")
+
+    with pytest.raises(InvalidCredentialError):
+        await service.authenticate(
+            outcome.account.id, challenge.challenge_id, assertion(uuid7().bytes)
+        )
+
+
+async def test_authenticate_with_credential_for_another_account(
+    service: IdentityService, store: FakeIdentityStore
+) -> None:
+    outcome = await service.create_account(NewAccount("a@test.com", "Tester"))
+    await add_passkey(service, outcome.account.id)
+    other_outcome = await service.create_account(NewAccount("b@test.com", "Other"))
+    other_credential_id = await add_passkey(service, other_outcome.account.id)
+    challenge = await service.create_authentication_challenge("a@test.com")
+
+    with pytest.raises(InvalidCredentialError):
+        await service.authenticate(
+            outcome.account.id, challenge.challenge_id, assertion(other_credential_id)
+        )
+
+
+async def test_authenticate_with_unknown_account(
+    service: IdentityService, store: FakeIdentityStore
+) -> None:
+    outcome = await service.create_account(NewAccount("a@test.com", "Tester"))
+    credential_id = await add_passkey(service, outcome.account.id)
+    challenge = await service.create_authentication_challenge("a@test.com")
+
+    with pytest.raises(InvalidAccountError):
+        await service.authenticate(
+            AccountID(), challenge.challenge_id, assertion(credential_id)
+        )
+
+
+@pytest.mark.parametrize(
+    "challenge_id",
+    [
+        challenge_id_created_at(datetime.now(timezone.utc) - timedelta(hours=1)),
+        ChallengeID("ch_not-base36"),
+    ],
+)
+async def test_authenticate_rejects_challenge_id_without_store_call(
+    service: IdentityService, store: FakeIdentityStore, challenge_id: ChallengeID
+) -> None:
+    outcome = await service.create_account(NewAccount("a@test.com", "Tester"))
+    credential_id = await add_passkey(service, outcome.account.id)
+
+    store.calls.clear()
+    with pytest.raises(ChallengeExpiredError):
+        await service.authenticate(
+            outcome.account.id, challenge_id, assertion(credential_id)
+        )
+    assert store.calls == []
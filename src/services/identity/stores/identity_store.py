@@ -78,12 +78,25 @@ class CredentialRecord:
     revoked_at: datetime | None
 
 
+@dataclass(frozen=True)
+class CredentialUseRecord:
+    id: bytes
+    use_count: int
+
+
 @dataclass(frozen=True)
 class CreateAccountOutcome:
     account: AccountRecord
     challenge: ChallengeRecord | None
 
 
+@dataclass(frozen=True)
+class AuthContextRecord:
+    account: AccountRecord | None
+    credential: CredentialRecord | None
+    challenge: ChallengeRecord | None
+
+
 @dataclass(frozen=True)
 class NewSessionRecord:
     id: SessionID
@@ -172,9 +185,13 @@ class IdentityStore(Protocol):
         self,
         new_credential: NewCredentialRecord,
         source_challenge_id: ChallengeID | None = None,
-    ) -> CredentialRecord:
+    ) -> CredentialRecord | None:
         """
         Creates a new credential.
+
+        If `source_challenge_id` is specified, that challenge is deleted
+        in the same operation, and None is returned without creating the
+        credential if the challenge no longer exists.
         """
 
     async def get_credential(self, id: bytes) -> CredentialRecord | None:
@@ -189,14 +206,31 @@ class IdentityStore(Protocol):
         Returns all credentials for a given account.
         """
 
+    async def get_auth_context(
+        self, account_id: AccountID, credential_id: bytes, challenge_id: ChallengeID
+    ) -> AuthContextRecord:
+        """
+        Gets the account, and the credential and unexpired challenge
+        if they exist for that account, all in one call.
+        """
+
     async def update_credential_use_count(self, id: bytes, new_count: int) -> None:
         """
         Updates the use count for a credential, to help detect replay attacks.
         """
 
-    async def create_session(self, new_session: NewSessionRecord) -> SessionRecord:
+    async def create_session(
+        self,
+        new_session: NewSessionRecord,
+        used_credential: CredentialUseRecord | None = None,
+    ) -> SessionRecord:
         """
         Creates a new session.
+
+        Parameters:
+            `new_session`: the session to create.
+            `used_credential`: if specified, the credential used to
+                authenticate, whose use count will also be updated.
         """
 
     async def get_session(
@@ -1,9 +1,8 @@
 from dataclasses import fields
-from datetime import datetime, timezone
-from typing import Any, Sequence, Type
+from typing import Any, Callable, Sequence
 
 from psycopg.errors import UniqueViolation
-from psycopg.rows import class_row
+from psycopg.rows import BaseRowFactory
 from psycopg.types.enum import EnumInfo, register_enum
 from psycopg_pool import AsyncConnectionPool
 
@@ -11,11 +10,13 @@ from src.lib.sql import SqlGenerator
 from src.services.identity.stores.identity_store import (
     AccountID,
     AccountRecord,
+    AuthContextRecord,
     ChallengeID,
     ChallengeRecord,
     CreateAccountOutcome,
     CredentialRecord,
     CredentialType,
+    CredentialUseRecord,
     EmailAlreadyExistsError,
     NewAccountRecord,
     NewChallengeRecord,
@@ -35,6 +36,20 @@ SESSIONS_TABLE = f"{SCHEMA_NAME}.sessions"
 SESSIONS_VIEW = f"{SCHEMA_NAME}.sessions_with_account"
 
 
+def _positional_row[T](cls: Callable[..., T]) -> BaseRowFactory[T]:
+    """
+    Returns a row factory that passes the column values to `cls` by
+    position. All the SQL here selects a record's columns in the same
+    order as its dataclass fields, so unlike psycopg's `class_row`,
+    this doesn't need to build a dict of column names for every row.
+    """
+
+    def make_row(values: Sequence[Any]) -> T:
+        return cls(*values)
+
+    return lambda cursor: make_row
+
+
 class PostgresIdentityStore:
     @classmethod
     async def create(cls, pool: AsyncConnectionPool) -> "PostgresIdentityStore":
@@ -55,94 +70,144 @@ class PostgresIdentityStore:
         return cls(pool)
 
     def __init__(self, pool: AsyncConnectionPool):
+        # All of the SQL used here has a fixed shape, so every statement
+        # is executed with prepare=True to have each connection parse
+        # and plan it once, instead of after psycopg's default 5 uses.
+        # Rows are also fetched in binary format, so bytea columns like
+        # challenge and key values aren't sent as hex text. Bytes params
+        # are already sent in binary by default.
         self._pool = pool
-        self._accounts_sql = SqlGenerator(ACCOUNTS_TABLE, AccountRecord)
-        self._challenges_sql = SqlGenerator(CHALLENGES_TABLE, ChallengeRecord)
-        self._credentials_sql = SqlGenerator(CREDENTIALS_TABLE, CredentialRecord)
-        self._sessions_sql = SqlGenerator(SESSIONS_TABLE, SessionRecord)
-        self._sessions_with_account_sql = SqlGenerator(
+        # Inserts take the New*Record fields and let the database fill in
+        # the rest with column defaults, returning the complete row.
+        self._accounts_sql = SqlGenerator.get(
+            ACCOUNTS_TABLE, AccountRecord, new_datacls=NewAccountRecord
+        )
+        self._challenges_sql = SqlGenerator.get(
+            CHALLENGES_TABLE, ChallengeRecord, new_datacls=NewChallengeRecord
+        )
+        self._credentials_sql = SqlGenerator.get(
+            CREDENTIALS_TABLE, CredentialRecord, new_datacls=NewCredentialRecord
+        )
+        self._sessions_sql = SqlGenerator.get(
+            SESSIONS_TABLE, SessionRecord, new_datacls=NewSessionRecord
+        )
+        self._sessions_with_account_sql = SqlGenerator.get(
             SESSIONS_VIEW, SessionWithAccountRecord
         )
+        self._account_row = _positional_row(AccountRecord)
+        self._challenge_row = _positional_row(ChallengeRecord)
+        self._credential_row = _positional_row(CredentialRecord)
+        self._session_row = _positional_row(SessionRecord)
+        self._session_with_account_row = _positional_row(SessionWithAccountRecord)
+        # Postgres runs every data-modifying statement in a WITH clause,
+        # so this inserts the account and its challenge in one round-trip.
+        # The foreign key on the challenge is checked at the end of the
+        # statement, after the account row exists.
+        self._insert_account_with_challenge_sql = (
+            f"with new_account as ({self._accounts_sql.insert_sql}),"
+            f" new_challenge as ({self._challenges_sql.insert_sql})"
+            " select * from new_account, new_challenge"
+        )
+        # The credential is only inserted if this statement deleted the
+        # source challenge, so a challenge can't be used twice, even by
+        # concurrent requests to different processes.
+        new_credential_columns = [f.name for f in fields(NewCredentialRecord)]
+        self._insert_credential_delete_challenge_sql = (
+            "with source_challenge as"
+            f" ({self._challenges_sql.delete_by_id_sql} returning id)"
+            f" insert into {CREDENTIALS_TABLE} ({','.join(new_credential_columns)})"
+            f" select {','.join(['%s'] * len(new_credential_columns))}"
+            " where exists (select 1 from source_challenge)"
+            f" returning {self._credentials_sql.column_list}"
+        )
+        self._select_unexpired_challenge_sql = (
+            f"{self._challenges_sql.select_by_id_sql} and expires_at > now()"
+        )
+        self._select_unexpired_session_sql = (
+            f"{self._sessions_with_account_sql.select_by_id_sql} and expires_at > now()"
+        )
+        self._update_credential_use_count_sql = (
+            f"update {CREDENTIALS_TABLE} set use_count=%s where id=%s"
+        )
+        self._update_credential_insert_session_sql = (
+            f"with used_credential as ({self._update_credential_use_count_sql})"
+            f" {self._sessions_sql.insert_sql}"
+        )
+        self._auth_context_sql = (
+            "select "
+            + ",".join(
+                [f"a.{c}" for c in self._accounts_sql.column_names]
+                + [f"cr.{c}" for c in self._credentials_sql.column_names]
+                + [f"ch.{c}" for c in self._challenges_sql.column_names]
+            )
+            + f" from {ACCOUNTS_TABLE} a"
+            + f" left join {CREDENTIALS_TABLE} cr"
+            + " on cr.id=%s and cr.account_id=a.id"
+            + f" left join {CHALLENGES_TABLE} ch"
+            + " on ch.id=%s and ch.account_id=a.id and ch.expires_at > now()"
+            + " where a.id=%s"
+        )
 
     async def create_account(
         self,
         new_account: NewAccountRecord,
         new_challenge: NewChallengeRecord | None = None,
     ) -> CreateAccountOutcome:
-        account = AccountRecord(
-            id=new_account.id,
-            email=new_account.email,
-            display_name=new_account.display_name,
-            created_at=datetime.now(timezone.utc),
-            updated_at=datetime.now(timezone.utc),
-            version=0,
-        )
-
-        challenge = (
-            None
-            if new_challenge is None
-            else ChallengeRecord(
-                id=new_challenge.id,
-                value=new_challenge.value,
-                account_id=new_challenge.account_id,
-                expires_at=new_challenge.expires_at,
-                created_at=datetime.now(timezone.utc),
-            )
-        )
+        # Postgres doesn't support executing multiple statements with
+        # parameters in the same batch query, so when there is a challenge
+        # both inserts are combined into a single statement instead.
+        params = self._accounts_sql.insert_params(new_account)
+        if new_challenge is None:
+            sql = self._accounts_sql.insert_sql
+        else:
+            sql = self._insert_account_with_challenge_sql
+            params += self._challenges_sql.insert_params(new_challenge)
 
         async with self._pool.connection() as conn:
-            # Unfortunately, Postgres doesn't support executing
-            # multiple statements with parameters in the
-            # the same batch query. So we have to insert the
-            # account and challenges separately. The psycopg library
-            # will automatically do these under the same database transaction.
-            # https://www.psycopg.org/psycopg3/docs/basic/transactions.html
-            account_params = [getattr(account, f.name) for f in fields(account)]
             try:
-                await conn.execute(self._accounts_sql.insert_sql, account_params)
+                result = await conn.execute(sql, params, prepare=True, binary=True)
             except UniqueViolation as e:
                 if e.diag.constraint_name == "email_must_be_unique":
                     raise EmailAlreadyExistsError()
                 else:
                     raise
+            row = await result.fetchone()
 
-            if challenge is not None:
-                challenge_params = [
-                    getattr(challenge, f.name) for f in fields(challenge)
-                ]
-                await conn.execute(self._challenges_sql.insert_sql, challenge_params)
-
-        return CreateAccountOutcome(account=account, challenge=challenge)
+        assert row is not None
+        challenge_start = len(self._accounts_sql.column_names)
+        return CreateAccountOutcome(
+            account=AccountRecord(*row[:challenge_start]),
+            challenge=(
+                None
+                if new_challenge is None
+                else ChallengeRecord(*row[challenge_start:])
+            ),
+        )
 
     async def get_account_by_id(self, id: AccountID) -> AccountRecord | None:
         return await self._fetch_one(
-            self._accounts_sql.select_by_id_sql, [id], AccountRecord
+            self._accounts_sql.select_by_id_sql, [id], self._account_row
         )
 
     async def get_account_by_email(self, email: str) -> AccountRecord | None:
         return await self._fetch_one(
-            self._accounts_sql.select_by_column("email"), [email], AccountRecord
+            self._accounts_sql.select_by_column("email"), [email], self._account_row
         )
 
     async def create_challenge(
         self, new_challenge: NewChallengeRecord
     ) -> ChallengeRecord:
-        challenge = ChallengeRecord(
-            id=new_challenge.id,
-            value=new_challenge.value,
-            account_id=new_challenge.account_id,
-            expires_at=new_challenge.expires_at,
-            created_at=datetime.now(timezone.utc),
-        )
-        params = [getattr(challenge, f.name) for f in fields(challenge)]
-        async with self._pool.connection() as conn:
-            await conn.execute(self._challenges_sql.insert_sql, params)
-
-        return challenge
+        return await self._insert(
+            self._challenges_sql.insert_sql,
+            self._challenges_sql.insert_params(new_challenge),
+            self._challenge_row,
+        )
 
     async def delete_challenge(self, challenge: bytes) -> None:
         async with self._pool.connection() as conn:
-            await conn.execute(self._challenges_sql.delete_by_id_sql, [challenge])
+            await conn.execute(
+                self._challenges_sql.delete_by_id_sql, [challenge], prepare=True
+            )
 
     async def get_challenge(
         self, id: ChallengeID, include_expired: bool = False
@@ -150,38 +215,32 @@ class PostgresIdentityStore:
         sql = (
             self._challenges_sql.select_by_id_sql
             if include_expired
-            else self._challenges_sql.select_by_id_sql + " and expires_at > now()"
+            else self._select_unexpired_challenge_sql
         )
-        return await self._fetch_one(sql, [id], ChallengeRecord)
+        return await self._fetch_one(sql, [id], self._challenge_row)
 
     async def create_credential(
         self,
         new_credential: NewCredentialRecord,
         source_challenge_id: ChallengeID | None = None,
-    ) -> CredentialRecord:
-        credential = CredentialRecord(
-            id=new_credential.id,
-            account_id=new_credential.account_id,
-            type=new_credential.type,
-            value=new_credential.value,
-            use_count=0,
-            created_at=datetime.now(timezone.utc),
-            revoked_at=None,
-        )
-        params = [getattr(credential, f.name) for f in fields(credential)]
-        async with self._pool.connection() as conn:
-            await conn.execute(self._credentials_sql.insert_sql, params)
-            # If a source_challenge was provided, delete it
-            if source_challenge_id is not None:
-                await conn.execute(
-                    self._challenges_sql.delete_by_id_sql, [source_challenge_id]
-                )
+    ) -> CredentialRecord | None:
+        params = self._credentials_sql.insert_params(new_credential)
+        if source_challenge_id is None:
+            return await self._insert(
+                self._credentials_sql.insert_sql, params, self._credential_row
+            )
 
-        return credential
+        # Delete the source challenge in the same statement. No row comes
+        # back if it was already deleted.
+        return await self._fetch_one(
+            self._insert_credential_delete_challenge_sql,
+            (source_challenge_id, *params),
+            self._credential_row,
+        )
 
     async def get_credential(self, id: bytes) -> CredentialRecord | None:
         return await self._fetch_one(
-            self._credentials_sql.select_by_id_sql, [id], CredentialRecord
+            self._credentials_sql.select_by_id_sql, [id], self._credential_row
         )
 
     async def get_account_credentials(
@@ -190,27 +249,62 @@ class PostgresIdentityStore:
         return await self._fetch_many(
             self._credentials_sql.select_by_column("account_id"),
             [account_id],
-            CredentialRecord,
+            self._credential_row,
         )
 
-    async def update_credential_use_count(self, id: bytes, new_count: int) -> None:
+    async def get_auth_context(
+        self, account_id: AccountID, credential_id: bytes, challenge_id: ChallengeID
+    ) -> AuthContextRecord:
         async with self._pool.connection() as conn:
-            await conn.execute(
-                f"update {CREDENTIALS_TABLE} set use_count=%s where id=%s",
-                [new_count, id],
+            result = await conn.execute(
+                self._auth_context_sql,
+                [credential_id, challenge_id, account_id],
+                prepare=True,
+                binary=True,
             )
+            row = await result.fetchone()
+
+        if row is None:
+            return AuthContextRecord(account=None, credential=None, challenge=None)
 
-    async def create_session(self, new_session: NewSessionRecord) -> SessionRecord:
-        session = SessionRecord(
-            id=new_session.id,
-            account_id=new_session.account_id,
-            expires_at=new_session.expires_at,
-            created_at=datetime.now(timezone.utc),
+        # The row has the account, credential, and challenge columns in order,
+        # and the left-joined ones are all null when there was no match.
+        credential_start = len(self._accounts_sql.column_names)
+        challenge_start = credential_start + len(self._credentials_sql.column_names)
+        return AuthContextRecord(
+            account=AccountRecord(*row[:credential_start]),
+            credential=(
+                None
+                if row[credential_start] is None
+                else CredentialRecord(*row[credential_start:challenge_start])
+            ),
+            challenge=(
+                None
+                if row[challenge_start] is None
+                else ChallengeRecord(*row[challenge_start:])
+            ),
         )
-        params = [getattr(session, f.name) for f in fields(session)]
+
+    async def update_credential_use_count(self, id: bytes, new_count: int) -> None:
         async with self._pool.connection() as conn:
-            await conn.execute(self._sessions_sql.insert_sql, params)
-            return session
+            await conn.execute(
+                self._update_credential_use_count_sql, [new_count, id], prepare=True
+            )
+
+    async def create_session(
+        self,
+        new_session: NewSessionRecord,
+        used_credential: CredentialUseRecord | None = None,
+    ) -> SessionRecord:
+        params = self._sessions_sql.insert_params(new_session)
+        if used_credential is None:
+            sql = self._sessions_sql.insert_sql
+        else:
+            # Update the credential use count in the same statement
+            sql = self._update_credential_insert_session_sql
+            params = (used_credential.use_count, used_credential.id, *params)
+
+        return await self._insert(sql, params, self._session_row)
 
     async def get_session(
         self, session_id: SessionID, included_expired: bool = False
@@ -218,27 +312,34 @@ class PostgresIdentityStore:
         sql = (
             self._sessions_with_account_sql.select_by_id_sql
             if included_expired
-            else self._sessions_with_account_sql.select_by_id_sql
-            + " and expires_at > now()"
+            else self._select_unexpired_session_sql
         )
         return await self._fetch_one(
             sql,
             [session_id],
-            SessionWithAccountRecord,
+            self._session_with_account_row,
         )
 
     async def _fetch_one[T](
-        self, sql: str, params: Sequence[Any], cls: Type[T]
+        self, sql: str, params: Sequence[Any], row_factory: BaseRowFactory[T]
     ) -> T | None:
         async with self._pool.connection() as conn:
-            async with conn.cursor(row_factory=class_row(cls)) as cur:
-                result = await cur.execute(sql, params)
+            async with conn.cursor(row_factory=row_factory, binary=True) as cur:
+                result = await cur.execute(sql, params, prepare=True)
                 return await result.fetchone()
 
+    async def _insert[T](
+        self, sql: str, params: Sequence[Any], row_factory: BaseRowFactory[T]
+    ) -> T:
+        record = await self._fetch_one(sql, params, row_factory)
+        # Just needed to appease the type-checker: inserts return the new row
+        assert record is not None
+        return record
+
     async def _fetch_many[T](
-        self, sql: str, params: Sequence[Any], cls: Type[T]
+        self, sql: str, params: Sequence[Any], row_factory: BaseRowFactory[T]
     ) -> Sequence[T]:
         async with self._pool.connection() as conn:
-            async with conn.cursor(row_factory=class_row(cls)) as cur:
-                result = await cur.execute(sql, params)
-                return await result.fetchmany()
+            async with conn.cursor(row_factory=row_factory, binary=True) as cur:
+                result = await cur.execute(sql, params, prepare=True)
+                return await result.fetchall()
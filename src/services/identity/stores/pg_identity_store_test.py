@@ -13,9 +13,13 @@ from src.services.identity.stores.identity_store import (
     AccountID,
     ChallengeID,
     CredentialType,
+    CredentialUseRecord,
+    EmailAlreadyExistsError,
     NewAccountRecord,
     NewChallengeRecord,
     NewCredentialRecord,
+    NewSessionRecord,
+    SessionID,
 )
 from src.services.identity.stores.pg_identity_store import PostgresIdentityStore
 
@@ -53,6 +57,7 @@ async def test_create_account_with_challenge(
     assert outcome.account.email == new_account.email
     assert outcome.account.display_name == new_account.display_name
     assert outcome.account.version == 0
+    assert outcome.account.created_at == outcome.account.updated_at
     assert outcome.challenge is not None
     assert outcome.challenge.id == new_challenge.id
     assert outcome.challenge.value == new_challenge.value
@@ -68,6 +73,27 @@ async def test_create_account_with_challenge(
     assert challenge.value == new_challenge.value
 
 
+async def test_create_account_duplicate_email(
+    email: str, store: PostgresIdentityStore
+) -> None:
+    await store.create_account(
+        NewAccountRecord(id=AccountID(), email=email, display_name="Tester")
+    )
+
+    new_account = NewAccountRecord(id=AccountID(), email=email, display_name="Tester")
+    new_challenge = NewChallengeRecord(
+        id=ChallengeID(),
+        value=secrets.token_bytes(64),
+        account_id=new_account.id,
+        expires_at=datetime.now(timezone.utc) + timedelta(hours=1),
+    )
+    with pytest.raises(EmailAlreadyExistsError):
+        await store.create_account(new_account, new_challenge)
+
+    assert await store.get_account_by_id(new_account.id) is None
+    assert await store.get_challenge(new_challenge.id) is None
+
+
 async def test_create_credential(email: str, store: PostgresIdentityStore) -> None:
     new_account = NewAccountRecord(id=AccountID(), email=email, display_name="Tester")
     await store.create_account(new_account)
@@ -77,6 +103,7 @@ async def test_create_credential(email: str, store: PostgresIdentityStore) -> No
         id=id, account_id=new_account.id, type=CredentialType.PASSKEY, value=b"abc"
     )
     credential = await store.create_credential(new_credential)
+    assert credential is not None
     assert credential.id == new_credential.id
     assert credential.value == new_credential.value
     assert credential.type == new_credential.type
@@ -89,3 +116,152 @@ async def test_create_credential(email: str, store: PostgresIdentityStore) -> No
 
     credentials = await store.get_account_credentials(new_account.id)
     assert len(credentials) == 1
+
+
+async def test_create_credential_deletes_source_challenge(
+    email: str, store: PostgresIdentityStore
+) -> None:
+    new_account = NewAccountRecord(id=AccountID(), email=email, display_name="Tester")
+    new_challenge = NewChallengeRecord(
+        id=ChallengeID(),
+        value=secrets.token_bytes(64),
+        account_id=new_account.id,
+        expires_at=datetime.now(timezone.utc) + timedelta(hours=1),
+    )
+    await store.create_account(new_account, new_challenge)
+
+    new_credential = NewCredentialRecord(
+        id=uuid7().bytes,
+        account_id=new_account.id,
+        type=CredentialType.PASSKEY,
+        value=b"abc",
+    )
+    await store.create_credential(new_credential, new_challenge.id)
+
+    assert await store.get_credential(new_credential.id) is not None
+    assert await store.get_challenge(new_challenge.id, include_expired=True) is None
+
+
+async def test_create_credential_with_used_challenge(
+    email: str, store: PostgresIdentityStore
+) -> None:
+    new_account = NewAccountRecord(id=AccountID(), email=email, display_name="Tester")
+    new_challenge = NewChallengeRecord(
+        id=ChallengeID(),
+        value=secrets.token_bytes(64),
+        account_id=new_account.id,
+        expires_at=datetime.now(timezone.utc) + timedelta(hours=1),
+    )
+    await store.create_account(new_account, new_challenge)
+
+    first = NewCredentialRecord(
+        id=uuid7().bytes,
+        account_id=new_account.id,
+        type=CredentialType.PASSKEY,
+        value=b"abc",
+    )
+    assert await store.create_credential(first, new_challenge.id) is not None
+
+    # Replaying the deleted challenge creates nothing
+    second = NewCredentialRecord(
+        id=uuid7().bytes,
+        account_id=new_account.id,
+        type=CredentialType.PASSKEY,
+        value=b"def",
+    )
+    assert await store.create_credential(second, new_challenge.id) is None
+    assert await store.get_credential(second.id) is None
+
+
+async def test_get_auth_context(email: str, store: PostgresIdentityStore) -> None:
+    new_account = NewAccountRecord(id=AccountID(), email=email, display_name="Tester")
+    new_challenge = NewChallengeRecord(
+        id=ChallengeID(),
+        value=secrets.token_bytes(64),
+        account_id=new_account.id,
+        expires_at=datetime.now(timezone.utc) + timedelta(hours=1),
+    )
+    await store.create_account(new_account, new_challenge)
+    new_credential = NewCredentialRecord(
+        id=uuid7().bytes,
+        account_id=new_account.id,
+        type=CredentialType.PASSKEY,
+        value=b"abc",
+    )
+    await store.create_credential(new_credential)
+
+    context = await store.get_auth_context(
+        new_account.id, new_credential.id, new_challenge.id
+    )
+    assert context.account is not None
+    assert context.account.email == email
+    assert context.credential is not None
+    assert context.credential.value == new_credential.value
+    assert context.credential.type == CredentialType.PASSKEY
+    assert context.challenge is not None
+    assert context.challenge.value == new_challenge.value
+
+    context = await store.get_auth_context(new_account.id, uuid7().bytes, ChallengeID())
+    assert context.account is not None
+    assert context.credential is None
+    assert context.challenge is None
+
+    context = await store.get_auth_context(
+        AccountID(), new_credential.id, new_challenge.id
+    )
+    assert context.account is None
+    assert context.credential is None
+    assert context.challenge is None
+
+
+async def test_get_account_credentials_returns_all(
+    email: str, store: PostgresIdentityStore
+) -> None:
+    new_account = NewAccountRecord(id=AccountID(), email=email, display_name="Tester")
+    await store.create_account(new_account)
+    ids = {uuid7().bytes for _ in range(3)}
+    for id in ids:
+        await store.create_credential(
+            NewCredentialRecord(
+                id=id,
+                account_id=new_account.id,
+                type=CredentialType.PASSKEY,
+                value=b"abc",
+            )
+        )
+
+    credentials = await store.get_account_credentials(new_account.id)
+    assert {c.id for c in credentials} == ids
+
+
+async def test_create_session_updates_used_credential(
+    email: str, store: PostgresIdentityStore
+) -> None:
+    new_account = NewAccountRecord(id=AccountID(), email=email, display_name="Tester")
+    await store.create_account(new_account)
+    new_credential = NewCredentialRecord(
+        id=uuid7().bytes,
+        account_id=new_account.id,
+        type=CredentialType.PASSKEY,
+        value=b"abc",
+    )
+    await store.create_credential(new_credential)
+
+    new_session = NewSessionRecord(
+        id=SessionID(),
+        account_id=new_account.id,
+        expires_at=datetime.now(timezone.utc) + timedelta(hours=1),
+    )
+    session = await store.create_session(
+        new_session, used_credential=CredentialUseRecord(new_credential.id, 5)
+    )
+    assert session.id == new_session.id
+    assert session.expires_at == new_session.expires_at
+
+    credential = await store.get_credential(new_credential.id)
+    assert credential is not None
+    assert credential.use_count == 5
+
+    session_with_account = await store.get_session(new_session.id)
+    assert session_with_account is not None
+    assert session_with_account.account_email == email